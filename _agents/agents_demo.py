@@ -2,6 +2,9 @@
 """
 agents_demo.py
 Planner -> Reviewer -> Finalizer flow using local Ollama (smollm:1.7b).
+By default a single combined call drafts and reviews in one generation; the
+two-stage Planner -> Reviewer path runs only if that output fails validation
+(or always, with --two-stage).
 Output: strict JSON with exactly 3 topical tags and a <=25-word summary.
 
 Usage (non-interactive):
@@ -10,94 +13,355 @@ Usage (non-interactive):
 Usage (interactive):
   python3 agents_demo.py
   (then follow prompts; finish content with Ctrl+D on mac/linux, Ctrl+Z then Enter on Windows)
+
+Final results are cached in ~/.cache/agents_demo/cache.sqlite keyed by
+title + content + model + prompt version + mode (combined or --two-stage);
+pass --no-cache to always call the model.
+
+Usage (batch, concurrent; requires `pip install aiohttp`):
+  OLLAMA_NUM_PARALLEL=4 ollama serve      # let the server handle requests in parallel
+  python3 agents_demo.py --batch posts.jsonl
+  (one {"title": ..., "content": ...} object per line, blank lines skipped; prints one final
+  JSON per post, or {"error": ...} for a post that failed; an unvalidated Planner-draft result
+  is flagged on stderr, and either makes the exit status 1; a malformed line aborts before
+  any model call; --concurrency defaults to $OLLAMA_NUM_PARALLEL)
 """
 import argparse
+import asyncio
+import hashlib
 import json
+import os
 import re
+import sqlite3
 import sys
 import time
-import urllib.request
 from datetime import datetime
-from typing import Any, Dict, Tuple
+from typing import Any, Dict, Generator, List, Optional, Tuple, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import aiohttp
+except ImportError:  # only needed for --batch
+    aiohttp = None
+
+try:
+    import orjson
+except ImportError:  # optional speedup; stdlib json is the fallback
+    orjson = None
 
 # ---- CONFIG ----
+def _env_number(name: str, default: Any, cast: Any) -> Any:
+    """Read a numeric env var; a blank or malformed value warns and uses the default instead of crashing."""
+    raw = os.environ.get(name, "").strip()
+    if not raw:
+        return default
+    try:
+        return cast(raw)
+    except ValueError:
+        print(f"WARNING: ignoring {name}={raw!r} (expected {cast.__name__}); using {default}.", file=sys.stderr)
+        return default
+
 OLLAMA_URL = "http://localhost:11434/api/generate"
 MODEL = "smollm:1.7b"
+# Bump when prompts or post-processing change so cached results are not reused.
+PROMPT_VERSION = "v1"
+CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "agents_demo", "cache.sqlite")
+CACHE_MAX_ENTRIES = 10000
+# Posts in flight at once in --batch; matches the server's parallel slots by default.
+BATCH_CONCURRENCY = _env_number("OLLAMA_NUM_PARALLEL", 4, int)
+# {tags, summary} is ~60 tokens; cap decoding so rambling output can't run long.
+AGENT_MAX_TOKENS = 128
+# Base delay (seconds) for retrying HTTP 5xx from a remote Ollama; 0 disables, e.g. 0.05
+# gives 0.05s, 0.1s. Localhost has no rate limit, so there is no pause by default.
+RETRY_BACKOFF = _env_number("OLLAMA_RETRY_BACKOFF", 0.0, float)
+HTTP_RETRIES = 2
+# Not "```": the model sometimes opens with a ```json fence, which would stop it before any JSON.
+STOP_SEQUENCES = ["\n\n\n"]
+
+# One keep-alive connection pool reused by every Planner/Reviewer call and retry.
+_SESSION = requests.Session()
+_SESSION.mount("http://", HTTPAdapter(pool_connections=8, pool_maxsize=32))
+
+# Compiled once; extract_json_object runs on every model response.
+_FENCED_RE = re.compile(r"```(?:json)?\s*({.*?})\s*```", re.DOTALL)
+
+_JSON_HEADERS = {"Content-Type": "application/json"}
 
 # ---- Utilities ----
-def ollama_generate(prompt: str, temperature: float = 0.3, timeout: int = 180) -> str:
-    """Call Ollama /api/generate and return the generated text (best-effort)."""
-    payload = {
+def json_dumps_bytes(obj: Any) -> bytes:
+    """Compact UTF-8 JSON, via orjson when available."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def canonical_json(obj: Any) -> str:
+    """Compact JSON string (no whitespace), used to embed one agent's output in the next prompt."""
+    return json_dumps_bytes(obj).decode("utf-8")
+
+def json_loads(data: Any) -> Any:
+    """Parse JSON from str or bytes, via orjson when available."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def build_payload(prompt: str, temperature: float, max_tokens: int, num_keep: Optional[int] = None,
+                  seed: Optional[int] = None) -> Dict[str, Any]:
+    options: Dict[str, Any] = {"temperature": temperature, "num_predict": max_tokens, "stop": STOP_SEQUENCES}
+    if num_keep is not None:
+        options["num_keep"] = num_keep
+    if seed is not None:
+        options["seed"] = seed
+    return {
         "model": MODEL,
         "prompt": prompt,
-        "stream": False,
-        "options": {"temperature": temperature},
+        "stream": True,
+        "options": options,
     }
-    data = json.dumps(payload).encode("utf-8")
-    req = urllib.request.Request(
-        OLLAMA_URL,
-        data=data,
-        headers={"Content-Type": "application/json"},
-        method="POST",
-    )
+
+def _retry_delay(status: int, attempt: int) -> Optional[float]:
+    """Seconds to wait before retrying an HTTP 5xx, or None to not retry."""
+    if status >= 500 and RETRY_BACKOFF > 0 and attempt < HTTP_RETRIES:
+        return RETRY_BACKOFF * 2 ** attempt
+    return None
+
+def ollama_generate(prompt: str, temperature: float = 0.3, timeout: int = 180, max_tokens: int = AGENT_MAX_TOKENS,
+                    num_keep: Optional[int] = None, seed: Optional[int] = None) -> str:
+    """
+    Call Ollama /api/generate and return the generated text (best-effort).
+    max_tokens caps decoding (num_predict); num_keep asks the server to keep that many
+    leading prompt tokens (the system block) cached; seed makes sampling reproducible.
+    """
+    data = json_dumps_bytes(build_payload(prompt, temperature, max_tokens, num_keep, seed))
     try:
-        with urllib.request.urlopen(req, timeout=timeout) as resp:
-            body = resp.read().decode("utf-8")
-            obj = json.loads(body)
-            # Many Ollama responses provide "response" key for textual content
-            # or "output" depending on version; try common keys.
-            if isinstance(obj, dict):
-                for key in ("response", "output", "message", "result"):
-                    if key in obj:
-                        val = obj[key]
-                        if isinstance(val, str):
-                            return val
-                        # sometimes nested
-                        if isinstance(val, dict) and "content" in val:
-                            return val["content"]
-                        # sometimes list of dicts
-                        if isinstance(val, list) and len(val) and isinstance(val[0], dict) and "content" in val[0]:
-                            return val[0]["content"]
-            # fallback: stringify entire object
-            return json.dumps(obj, ensure_ascii=False)
-    except Exception as e:
-        print("ERROR: Could not call Ollama at http://localhost:11434.", file=sys.stderr)
-        print("Checklist:", file=sys.stderr)
-        print("1) Is Ollama running? (open Ollama app or run the service).", file=sys.stderr)
-        print("2) Have you pulled the model? `ollama pull smollm:1.7b`", file=sys.stderr)
-        print("3) Can you `curl http://localhost:11434/` ?", file=sys.stderr)
+        for attempt in range(HTTP_RETRIES + 1):
+            resp = _SESSION.post(OLLAMA_URL, data=data, headers=_JSON_HEADERS, timeout=timeout, stream=True)
+            delay = _retry_delay(resp.status_code, attempt)
+            if delay is not None:
+                resp.close()
+                time.sleep(delay)
+                continue
+            collector = _StreamCollector()
+            with resp:
+                resp.raise_for_status()
+                if not _is_ndjson(resp.headers.get("Content-Type", "")):
+                    return response_text(json_loads(resp.content))
+                # unless cut short, iterate until the body ends so the connection
+                # returns to _SESSION's pool
+                for line in resp.iter_lines():
+                    if collector.feed_line(line):
+                        # commentary after the JSON: dropping the socket makes Ollama
+                        # stop decoding the tail
+                        resp.close()
+                        break
+            return collector.text()
+    except Exception:
+        print_ollama_checklist()
         raise
 
-def extract_json_object(text: str) -> Dict[str, Any]:
+async def ollama_generate_async(session: "aiohttp.ClientSession", prompt: str, temperature: float = 0.3, timeout: int = 180,
+                                max_tokens: int = AGENT_MAX_TOKENS, num_keep: Optional[int] = None,
+                                seed: Optional[int] = None) -> str:
+    """Async variant of ollama_generate sharing one aiohttp session across calls."""
+    data = json_dumps_bytes(build_payload(prompt, temperature, max_tokens, num_keep, seed))
+    try:
+        for attempt in range(HTTP_RETRIES + 1):
+            async with session.post(OLLAMA_URL, data=data, headers=_JSON_HEADERS,
+                                    timeout=aiohttp.ClientTimeout(total=timeout)) as resp:
+                delay = _retry_delay(resp.status, attempt)
+                if delay is not None:
+                    await asyncio.sleep(delay)
+                    continue
+                resp.raise_for_status()
+                if not _is_ndjson(resp.headers.get("Content-Type", "")):
+                    return response_text(json_loads(await resp.read()))
+                collector = _StreamCollector()
+                # as above: read to the end unless commentary follows the JSON
+                async for line in resp.content:
+                    if collector.feed_line(line):
+                        resp.close()
+                        break
+                return collector.text()
+    except Exception:
+        print_ollama_checklist()
+        raise
+
+def _is_ndjson(content_type: str) -> bool:
+    # a server or proxy that ignores "stream" answers with one application/json body
+    return "ndjson" in content_type
+
+def response_text(obj: Any) -> str:
+    """Pull the generated text out of a non-stream Ollama response body (best-effort)."""
+    # /api/generate always uses "response"; other shapes go through the slow path.
+    if isinstance(obj, dict):
+        resp = obj.get("response")
+        if isinstance(resp, str):
+            return resp
+    return _parse_fallback(obj)
+
+def _parse_fallback(obj: Any) -> str:
+    # Older/other Ollama versions may use "output" or nest the content; try common keys.
+    if isinstance(obj, dict):
+        for key in ("response", "output", "message", "result"):
+            if key in obj:
+                val = obj[key]
+                if isinstance(val, str):
+                    return val
+                # sometimes nested
+                if isinstance(val, dict) and "content" in val:
+                    return val["content"]
+                # sometimes list of dicts
+                if isinstance(val, list) and len(val) and isinstance(val[0], dict) and "content" in val[0]:
+                    return val[0]["content"]
+    # fallback: stringify entire object
+    return json.dumps(obj, ensure_ascii=False)
+
+class _StreamCollector:
+    """
+    Accumulates /api/generate stream lines. Once the first {...} in the output has
+    closed and parsed, any further non-whitespace text is commentary the model is
+    still decoding, so feed_line asks the caller to cut the stream there. A clean
+    response (the JSON, optional whitespace, then the done line) is read to the end
+    so its connection goes back to the keep-alive pool.
+    """
+
+    def __init__(self) -> None:
+        self.parts: List[str] = []
+        self.scanner = _BraceScanner()
+        self.scanning = True
+        # True once the first {...} has closed and parsed
+        self.closed = False
+
+    def feed_line(self, line: bytes) -> bool:
+        """Add one stream line; True means stop reading now and drop the connection."""
+        if not line.strip():
+            return False
+        obj = json_loads(line)
+        if isinstance(obj, dict) and "error" in obj:
+            raise RuntimeError(f"Ollama error: {obj['error']}")
+        # stream lines carry text only under "response"; metadata-only lines add nothing
+        chunk = obj.get("response") if isinstance(obj, dict) else None
+        if not isinstance(chunk, str):
+            chunk = ""
+        self.parts.append(chunk)
+        if self.closed:
+            return bool(chunk.strip())
+        if self.scanning and self.scanner.feed(chunk):
+            text = self.text()
+            if _as_object(text[self.scanner.start:self.scanner.end]) is not None:
+                self.closed = True
+                # the closing chunk may already carry the start of trailing commentary
+                return bool(text[self.scanner.end:].strip())
+            # the first {...} was not JSON (e.g. braces in prose): read to the end instead
+            self.scanning = False
+        return False
+
+    def text(self) -> str:
+        return "".join(self.parts)
+
+def print_ollama_checklist() -> None:
+    print("ERROR: Could not call Ollama at http://localhost:11434.", file=sys.stderr)
+    print("Checklist:", file=sys.stderr)
+    print("1) Is Ollama running? (open Ollama app or run the service).", file=sys.stderr)
+    print("2) Have you pulled the model? `ollama pull smollm:1.7b`", file=sys.stderr)
+    print("3) Can you `curl http://localhost:11434/` ?", file=sys.stderr)
+
+class _BraceScanner:
     """
-    Extract the first JSON object from text robustly.
-    Accepts fenced ```json { ... } ``` or plain {...} inside text.
-    Raises ValueError if none found or cannot parse.
+    Single-pass, incremental scan for the first balanced {...}, skipping braces
+    inside JSON strings. Text can be fed in chunks as it streams in.
+    """
+
+    def __init__(self) -> None:
+        self.consumed = 0
+        self.start = -1
+        self.end = -1
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+
+    def feed(self, chunk: str) -> bool:
+        """Consume more text; returns True once the first object has closed."""
+        if self.end >= 0:
+            return True
+        offset = self.consumed
+        self.consumed += len(chunk)
+        i = 0
+        if self.start < 0:
+            i = chunk.find("{")
+            if i < 0:
+                return False
+            self.start = offset + i
+        for j in range(i, len(chunk)):
+            ch = chunk[j]
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == '"':
+                self.in_string = True
+            elif ch == "{":
+                self.depth += 1
+            elif ch == "}":
+                self.depth -= 1
+                if self.depth == 0:
+                    self.end = offset + j + 1
+                    return True
+        return False
+
+def _find_json_span(s: str) -> Optional[Tuple[int, int]]:
+    """(start, end) slice bounds of the first balanced {...} in s, or None if there is none."""
+    scanner = _BraceScanner()
+    if scanner.feed(s):
+        return scanner.start, scanner.end
+    return None
+
+class JSONExtractionError(ValueError):
+    """Model output did not contain a parseable JSON object."""
+
+def _as_object(candidate: str) -> Optional[Dict[str, Any]]:
+    try:
+        obj = json_loads(candidate)
+    except ValueError:
+        return None
+    return obj if isinstance(obj, dict) else None
+
+def extract_json_object(text: str, allow_bare: bool = True) -> Dict[str, Any]:
+    """
+    Extract the first JSON object from text robustly, cheapest path first:
+    the whole text as bare JSON (if allow_bare), a fenced ```json { ... } ```
+    block, then the first balanced {...} inside text.
+    Raises JSONExtractionError if none found or cannot parse.
     """
     if not text:
-        raise ValueError("Empty model output")
+        raise JSONExtractionError("Empty model output")
 
-    # try fenced code block first
-    fenced = re.search(r"```(?:json)?\s*({.*?})\s*```", text, flags=re.DOTALL)
+    if allow_bare:
+        stripped = text.strip()
+        if stripped.startswith("{"):
+            obj = _as_object(stripped)
+            if obj is not None:
+                return obj
+
+    fenced = _FENCED_RE.search(text)
     if fenced:
-        candidate = fenced.group(1).strip()
-        try:
-            return json.loads(candidate)
-        except Exception:
-            pass
-
-    # fallback: find first {...}
-    m = re.search(r"({.*})", text, flags=re.DOTALL)
-    if not m:
-        raise ValueError("No JSON object found in model output.")
-    candidate = m.group(1).strip()
-    # trim to last matching brace
-    last = candidate.rfind("}")
-    candidate = candidate[: last + 1]
-    return json.loads(candidate)
-
-def word_count(s: str) -> int:
-    return len([w for w in s.strip().split() if w])
+        obj = _as_object(fenced.group(1).strip())
+        if obj is not None:
+            return obj
+
+    # fallback: first balanced {...}
+    span = _find_json_span(text)
+    if span is None:
+        raise JSONExtractionError("No JSON object found in model output.")
+    a, b = span
+    obj = _as_object(text[a:b])
+    if obj is None:
+        raise JSONExtractionError("Could not parse JSON object in model output.")
+    return obj
 
 def enforce_constraints(obj: Dict[str, Any]) -> Dict[str, Any]:
     """
@@ -117,101 +381,340 @@ def enforce_constraints(obj: Dict[str, Any]) -> Dict[str, Any]:
         tags.append("tag")
 
     summary = str(summary).strip()
-    if word_count(summary) > 25:
-        summary = " ".join(summary.split()[:25])
+    parts = summary.split()
+    if len(parts) > 25:
+        summary = " ".join(parts[:25])
 
     return {"tags": tags, "summary": summary}
 
+# ---- Prompts ----
+# System blocks are module constants and always lead the prompt, byte-identical
+# across calls and retries, so Ollama can reuse their KV-cache prefix.
+PLANNER_SYSTEM = (
+    "You are Planner. Create a first draft for tags + summary.\n"
+    "Return ONLY a JSON object with keys: tags, summary.\n"
+    "Constraints:\n"
+    "- tags: array of exactly 3 short topical tags (2-4 words each if possible)\n"
+    "- summary: ONE sentence, <= 25 words\n"
+    "- No extra keys, no commentary, no markdown.\n"
+    "Do not hardcode any domain; infer from the given title/content.\n"
+)
+
+REVIEWER_SYSTEM = (
+    "You are Reviewer. Review Planner's JSON and improve relevance/clarity.\n"
+    "RETURN EXACTLY and ONLY a JSON object with keys: tags, summary.\n"
+    "- tags: an array of exactly 3 topical tags (strings).\n"
+    "- summary: ONE sentence, 25 words max.\n"
+    "NO extra keys, NO commentary, NO markdown, NO surrounding text.\n"
+    "Infer tags & summary only from TITLE and CONTENT provided.\n"
+)
+
+REVIEWER_RETRY_NOTE = (
+    "IMPORTANT: The previous output did not follow the required JSON shape. "
+    "Return ONLY and EXACTLY: {\"tags\": [\"tag1\",\"tag2\",\"tag3\"], \"summary\": \"one sentence <=25 words\"}. "
+    "Do not include any other keys or commentary. Repair the JSON now."
+)
+
+COMBINED_SYSTEM = (
+    "You are Planner and Reviewer in one. Internally draft tags + summary, review the draft\n"
+    "for relevance/clarity, then output ONLY the improved final JSON object with keys: tags, summary.\n"
+    "Constraints:\n"
+    "- tags: array of exactly 3 short topical tags (2-4 words each if possible)\n"
+    "- summary: ONE sentence, <= 25 words\n"
+    "- No extra keys, no commentary, no markdown, do not show the draft.\n"
+    "Infer tags & summary only from TITLE and CONTENT provided.\n"
+)
+
+def system_num_keep(system: str) -> int:
+    """
+    Token count to pin for a system block. There is no tokenizer here, so use the
+    whitespace word count: a slight underestimate, never past the system block.
+    """
+    return len(system.split())
+
+PLANNER_NUM_KEEP = system_num_keep(PLANNER_SYSTEM)
+REVIEWER_NUM_KEEP = system_num_keep(REVIEWER_SYSTEM)
+COMBINED_NUM_KEEP = system_num_keep(COMBINED_SYSTEM)
+
 # ---- Agents ----
-def planner_agent(title: str, content: str) -> Tuple[str, Dict[str, Any]]:
-    system = (
-        "You are Planner. Create a first draft for tags + summary.\n"
-        "Return ONLY a JSON object with keys: tags, summary.\n"
-        "Constraints:\n"
-        "- tags: array of exactly 3 short topical tags (2-4 words each if possible)\n"
-        "- summary: ONE sentence, <= 25 words\n"
-        "- No extra keys, no commentary, no markdown.\n"
-        "Do not hardcode any domain; infer from the given title/content.\n"
-    )
+# Each agent is written once as a generator: it yields the keyword arguments for
+# every ollama_generate call and is sent the generated text back. run_agent and
+# run_agent_async drive the same generator over the blocking or aiohttp transport,
+# so prompts, retries, sampling and validation can't drift between the two.
+AgentSteps = Generator[Dict[str, Any], str, Any]
+
+def run_agent(steps: AgentSteps) -> Any:
+    try:
+        request = next(steps)
+        while True:
+            request = steps.send(ollama_generate(**request))
+    except StopIteration as done:
+        return done.value
+
+async def run_agent_async(session: "aiohttp.ClientSession", steps: AgentSteps) -> Any:
+    try:
+        request = next(steps)
+        while True:
+            request = steps.send(await ollama_generate_async(session, **request))
+    except StopIteration as done:
+        return done.value
+
+def planner_prompt(title: str, content: str) -> str:
     user = f"TITLE:\n{title}\n\nCONTENT:\n{content}\n\nReturn the JSON now."
-    prompt = system + "\n\n" + user
-    raw = ollama_generate(prompt, temperature=0.4)
+    return PLANNER_SYSTEM + "\n\n" + user
+
+def planner_parse(raw: str) -> Dict[str, Any]:
     try:
         obj = extract_json_object(raw)
-    except Exception:
-        # fallback: try to parse raw as JSON directly
-        try:
-            obj = json.loads(raw)
-        except Exception:
-            obj = {}
-    obj = enforce_constraints(obj)
-    return raw, obj
-
-def reviewer_agent(title: str, content: str, draft: Dict[str, Any]) -> Tuple[str, Dict[str, Any], bool]:
-    """
-    Robust reviewer: retries up to max_retries if the model doesn't return expected keys.
-    Returns (raw_text, parsed_obj, changed_bool).
-    """
-    base_system = (
-        "You are Reviewer. Review Planner's JSON and improve relevance/clarity.\n"
-        "RETURN EXACTLY and ONLY a JSON object with keys: tags, summary.\n"
-        "- tags: an array of exactly 3 topical tags (strings).\n"
-        "- summary: ONE sentence, 25 words max.\n"
-        "NO extra keys, NO commentary, NO markdown, NO surrounding text.\n"
-        "Infer tags & summary only from TITLE and CONTENT provided.\n"
-    )
+    except JSONExtractionError:
+        obj = {}
+    return enforce_constraints(obj)
+
+def planner_steps(title: str, content: str) -> AgentSteps:
+    """Returns (raw_text, parsed_obj, draft_json) where draft_json is the canonical JSON for the Reviewer."""
+    raw = yield dict(prompt=planner_prompt(title, content), temperature=0.4,
+                     max_tokens=AGENT_MAX_TOKENS, num_keep=PLANNER_NUM_KEEP)
+    obj = planner_parse(raw)
+    return raw, obj, canonical_json(obj)
+
+def planner_agent(title: str, content: str) -> Tuple[str, Dict[str, Any], str]:
+    return run_agent(planner_steps(title, content))
+
+# The Planner has already read the full post; the Reviewer only needs enough
+# content to judge relevance, and prefill time grows with prompt length.
+REVIEWER_CONTENT_CHARS = 1500
+
+def reviewer_prefix(title: str, content: str, draft_json: str) -> str:
+    """The part of the Reviewer prompt that is identical across attempts; build it once per post."""
+    content = content[:REVIEWER_CONTENT_CHARS]
+    return f"{REVIEWER_SYSTEM}\n\nTITLE:\n{title}\n\nCONTENT:\n{content}\n\nPLANNER_JSON:\n{draft_json}\n\n"
+
+def reviewer_prompt(prefix: str, retry: bool = False) -> str:
+    # the stricter retry message goes last so retries share the whole prefix with the first attempt
+    return prefix + (REVIEWER_RETRY_NOTE if retry else "Return the improved JSON now.")
+
+def validated_json(raw: str) -> Optional[Dict[str, Any]]:
+    """Return the normalized JSON from model output, or None if it has the wrong shape."""
+    try:
+        parsed = extract_json_object(raw)
+    except JSONExtractionError:
+        parsed = {}
 
-    user_block = (
-        f"TITLE:\n{title}\n\nCONTENT:\n{content}\n\n"
-        f"PLANNER_JSON:\n{json.dumps(draft, ensure_ascii=False)}\n\nReturn the improved JSON now."
-    )
+    # quick validity checks
+    tags_ok = isinstance(parsed.get("tags"), list) and len([t for t in parsed.get("tags", []) if str(t).strip()]) >= 1
+    summary_ok = isinstance(parsed.get("summary"), str) and len(parsed.get("summary", "").strip()) > 0
+
+    if tags_ok and summary_ok:
+        return enforce_constraints(parsed)
+    return None
+
+REVIEWER_MAX_RETRIES = 2
+REVIEWER_TEMPERATURE = 0.25
+
+def reviewer_sampling(title: str, attempt: int) -> Tuple[float, int]:
+    """
+    (temperature, seed) for a Reviewer attempt. Seeds are derived from the title
+    (blake2b, so stable across runs unlike hash()) and step per attempt, so a retry
+    never replays the same failed sample. The last retry decodes greedily.
+    """
+    base = int.from_bytes(hashlib.blake2b(title.encode("utf-8"), digest_size=4).digest(), "big")
+    temperature = 0.0 if attempt == REVIEWER_MAX_RETRIES else REVIEWER_TEMPERATURE
+    return temperature, (base + attempt) & 0xFFFFFFFF
 
-    attempt = 0
-    max_retries = 2
+def reviewer_steps(title: str, content: str, draft: Dict[str, Any], draft_json: Optional[str] = None) -> AgentSteps:
+    """
+    Robust reviewer: retries up to REVIEWER_MAX_RETRIES if the model doesn't return expected keys.
+    Pass the Planner's draft_json to reuse it instead of re-serializing draft.
+    Returns (raw_text, parsed_obj, changed_bool, fell_back_bool); fell_back is True when
+    no attempt validated and parsed_obj is just the normalized Planner draft.
+    """
+    if draft_json is None:
+        draft_json = canonical_json(draft)
+    prefix = reviewer_prefix(title, content, draft_json)
     last_raw = ""
-    while attempt <= max_retries:
-        attempt += 1
-        prompt = base_system + "\n\n" + user_block
-        raw = ollama_generate(prompt, temperature=0.25)
+    for attempt in range(REVIEWER_MAX_RETRIES + 1):
+        temperature, seed = reviewer_sampling(title, attempt)
+        raw = yield dict(prompt=reviewer_prompt(prefix, retry=attempt > 0), temperature=temperature,
+                         max_tokens=AGENT_MAX_TOKENS, num_keep=REVIEWER_NUM_KEEP, seed=seed)
         last_raw = raw
-        try:
-            parsed = extract_json_object(raw)
-        except Exception:
-            parsed = {}
-
-        # quick validity checks
-        tags_ok = isinstance(parsed.get("tags"), list) and len([t for t in parsed.get("tags", []) if str(t).strip()]) >= 1
-        summary_ok = isinstance(parsed.get("summary"), str) and len(parsed.get("summary", "").strip()) > 0
-
-        if tags_ok and summary_ok:
-            parsed = enforce_constraints(parsed)
-            changed = (parsed != draft)
-            return raw, parsed, changed
-
-        # prepare a stricter retry message
-        user_block = (
-            "IMPORTANT: The previous output did not follow the required JSON shape. "
-            "Return ONLY and EXACTLY: {\"tags\": [\"tag1\",\"tag2\",\"tag3\"], \"summary\": \"one sentence <=25 words\"}. "
-            "Do not include any other keys or commentary. Repair the JSON now.\n\n"
-            f"TITLE:\n{title}\n\nCONTENT:\n{content}\n\nPLANNER_JSON:\n{json.dumps(draft, ensure_ascii=False)}\n\n"
-        )
-        time.sleep(0.6)  # brief pause
+        parsed = validated_json(raw)
+        if parsed is not None:
+            return raw, parsed, (parsed != draft), False
 
     # All retries failed — fall back to planner draft (normalized)
     fallback = enforce_constraints(draft)
-    return last_raw, fallback, (fallback != draft)
+    return last_raw, fallback, (fallback != draft), True
+
+def reviewer_agent(title: str, content: str, draft: Dict[str, Any], draft_json: Optional[str] = None) -> Tuple[str, Dict[str, Any], bool, bool]:
+    return run_agent(reviewer_steps(title, content, draft, draft_json))
+
+def combined_prompt(title: str, content: str) -> str:
+    user = f"TITLE:\n{title}\n\nCONTENT:\n{content}\n\nReturn the final JSON now."
+    return COMBINED_SYSTEM + "\n\n" + user
+
+def combined_steps(title: str, content: str) -> AgentSteps:
+    """
+    Single-call Planner+Reviewer. Returns (raw_text, parsed_obj), with parsed_obj
+    None when the output fails validation and the two-stage path should run.
+    """
+    raw = yield dict(prompt=combined_prompt(title, content), temperature=0.25,
+                     max_tokens=AGENT_MAX_TOKENS, num_keep=COMBINED_NUM_KEEP)
+    return raw, validated_json(raw)
+
+def combined_agent(title: str, content: str) -> Tuple[str, Optional[Dict[str, Any]]]:
+    return run_agent(combined_steps(title, content))
 
 def finalizer(reviewed: Dict[str, Any]) -> Dict[str, Any]:
     """Final enforcement - returns strict JSON."""
     return enforce_constraints(reviewed)
 
+def pipeline_steps(title: str, content: str, two_stage: bool = False) -> AgentSteps:
+    """
+    Combined (or Planner -> Reviewer) -> Finalizer for one post. Returns
+    (final_json, validated_bool); validated is False when the Reviewer fell back
+    to the Planner draft, and such results must not be cached.
+    """
+    if not two_stage:
+        _, combined_json = yield from combined_steps(title, content)
+        if combined_json is not None:
+            return finalizer(combined_json), True
+    _, planner_json, draft_json = yield from planner_steps(title, content)
+    _, reviewer_json, _, fell_back = yield from reviewer_steps(title, content, planner_json, draft_json)
+    return finalizer(reviewer_json), not fell_back
+
+# ---- Result cache ----
+def cache_key(title: str, content: str, two_stage: bool = False) -> str:
+    # the mode is part of the key so --two-stage A/B runs never see combined-call results
+    mode = "two-stage" if two_stage else "combined"
+    raw = title + "\0" + content + "\0" + MODEL + "\0" + PROMPT_VERSION + "\0" + mode
+    return hashlib.blake2b(raw.encode("utf-8"), digest_size=16).hexdigest()
+
+def cache_open(path: str = CACHE_PATH) -> sqlite3.Connection:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT, ts REAL)")
+    return conn
+
+def cache_get(conn: sqlite3.Connection, key: str) -> Optional[Dict[str, Any]]:
+    row = conn.execute("SELECT value FROM cache WHERE key = ?", (key,)).fetchone()
+    if row is None:
+        return None
+    # touch for LRU eviction
+    conn.execute("UPDATE cache SET ts = ? WHERE key = ?", (time.time(), key))
+    conn.commit()
+    return json_loads(row[0])
+
+def cache_put(conn: sqlite3.Connection, key: str, value: Dict[str, Any]) -> None:
+    conn.execute("INSERT OR REPLACE INTO cache (key, value, ts) VALUES (?, ?, ?)", (key, canonical_json(value), time.time()))
+    conn.execute(
+        "DELETE FROM cache WHERE key NOT IN (SELECT key FROM cache ORDER BY ts DESC LIMIT ?)",
+        (CACHE_MAX_ENTRIES,),
+    )
+    conn.commit()
+
+# ---- Batch (concurrent) ----
+async def pipeline_async(session: "aiohttp.ClientSession", title: str, content: str,
+                         two_stage: bool = False) -> Tuple[Dict[str, Any], bool]:
+    """pipeline_steps for one post, without blocking other posts."""
+    return await run_agent_async(session, pipeline_steps(title, content, two_stage))
+
+async def process_batch(items: List[Tuple[str, str]], two_stage: bool = False,
+                        conn: Optional[sqlite3.Connection] = None,
+                        concurrency: int = BATCH_CONCURRENCY) -> List[Union[Tuple[Dict[str, Any], bool], Exception]]:
+    """
+    Run the pipeline for many (title, content) posts concurrently, at most
+    `concurrency` at a time. Ollama only serves OLLAMA_NUM_PARALLEL requests at
+    once and queues the rest, and queued time counts against each request's
+    timeout, so there is no point sending more than that.
+    With a cache connection, only cache misses reach the model, and each validated
+    result is cached as soon as it finishes.
+    Each post yields (final, validated), where validated is False for the Planner-draft
+    fallback (cache hits are always validated); a post that fails yields its exception
+    in place of a result, and the others still complete.
+    """
+    results: List[Union[Tuple[Dict[str, Any], bool], Exception, None]] = [None] * len(items)
+    keys = [cache_key(t, c, two_stage) for t, c in items]
+    if conn is not None:
+        for i, key in enumerate(keys):
+            hit = cache_get(conn, key)
+            if hit is not None:
+                results[i] = (hit, True)
+    misses = [i for i, r in enumerate(results) if r is None]
+    if misses:
+        if aiohttp is None:
+            raise RuntimeError("--batch needs aiohttp: `pip install aiohttp`")
+        limit = asyncio.Semaphore(max(1, concurrency))
+
+        async def run_one(session: "aiohttp.ClientSession", i: int) -> Tuple[Dict[str, Any], bool]:
+            async with limit:
+                final, validated = await pipeline_async(session, *items[i], two_stage)
+            if conn is not None and validated:
+                cache_put(conn, keys[i], final)
+            return final, validated
+
+        async with aiohttp.ClientSession() as session:
+            finals = await asyncio.gather(*[run_one(session, i) for i in misses], return_exceptions=True)
+        for i, final in zip(misses, finals):
+            results[i] = final
+    return results
+
+def load_batch(path: str) -> List[Tuple[str, str]]:
+    """
+    Read one {"title": ..., "content": ...} object per line (blank lines skipped).
+    The whole file is checked before any model call; a bad line raises ValueError
+    naming the file and line number.
+    """
+    items = []
+    with open(path, encoding="utf-8") as f:
+        for lineno, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                rec = json_loads(line)
+            except ValueError as e:
+                raise ValueError(f"{path}:{lineno}: invalid JSON ({e})") from None
+            if not isinstance(rec, dict):
+                raise ValueError(f"{path}:{lineno}: expected a JSON object with title and content, got {type(rec).__name__}")
+            items.append((str(rec.get("title", "")), str(rec.get("content", ""))))
+    return items
+
 # ---- Main ----
 def main():
     parser = argparse.ArgumentParser(description="Planner -> Reviewer -> Finalizer with Ollama (smollm:1.7b).")
     parser.add_argument("--title", type=str, help="Blog title")
     parser.add_argument("--content", type=str, help="Blog content")
+    parser.add_argument("--batch", type=str, help="JSONL file of {title, content} posts to process concurrently")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY,
+                        help="Max posts in flight with --batch (default: $OLLAMA_NUM_PARALLEL or 4)")
+    parser.add_argument("--two-stage", action="store_true", help="Always run separate Planner and Reviewer calls (A/B vs. the combined call)")
+    parser.add_argument("--no-cache", action="store_true", help="Skip the on-disk result cache")
     args = parser.parse_args()
 
+    conn = None if args.no_cache else cache_open()
+
+    if args.batch:
+        try:
+            items = load_batch(args.batch)
+        except (OSError, ValueError) as e:
+            print(f"ERROR: {e}", file=sys.stderr)
+            sys.exit(2)
+        failed = 0
+        for n, result in enumerate(asyncio.run(process_batch(items, args.two_stage, conn, args.concurrency)), 1):
+            # one output line per non-blank input line; failures are reported in place
+            if isinstance(result, Exception):
+                failed += 1
+                final = {"error": f"{type(result).__name__}: {result}"}
+            else:
+                final, validated = result
+                if not validated:
+                    # the placeholder is still printed to keep lines aligned, but it is not a real result
+                    failed += 1
+                    print(f"WARNING: post {n}: no Reviewer attempt validated; printed the Planner draft, not cached.", file=sys.stderr)
+            print(json.dumps(final, ensure_ascii=False))
+        if failed:
+            sys.exit(1)
+        return
+
     title = args.title
     content = args.content
 
@@ -221,21 +724,45 @@ def main():
         print("Enter blog content (finish with Ctrl+D on mac/Linux, Ctrl+Z then Enter on Windows):")
         content = sys.stdin.read().strip()
 
-    print("\n=== Planner Output (raw) ===")
-    planner_raw, planner_json = planner_agent(title, content)
-    print(planner_raw.strip())
-
-    print("\n=== Planner Output (parsed+normalized) ===")
-    print(json.dumps(planner_json, indent=2, ensure_ascii=False))
-
-    print("\n=== Reviewer Output (raw) ===")
-    reviewer_raw, reviewer_json, changed = reviewer_agent(title, content, planner_json)
-    print(reviewer_raw.strip())
-
-    print("\n=== Reviewer Output (parsed+normalized) ===")
-    print(json.dumps(reviewer_json, indent=2, ensure_ascii=False))
-
-    final = finalizer(reviewer_json)
+    key = cache_key(title, content, args.two_stage)
+    final = cache_get(conn, key) if conn is not None else None
+    cached = final is not None
+    changed = None
+    validated = True
+    if cached:
+        print("\n=== Cache hit (model calls skipped) ===")
+    elif not args.two_stage:
+        print("\n=== Combined Output (raw) ===")
+        combined_raw, combined_json = combined_agent(title, content)
+        print(combined_raw.strip())
+        if combined_json is not None:
+            final = finalizer(combined_json)
+        else:
+            print("\n(combined output failed validation; falling back to Planner -> Reviewer)")
+
+    if final is None:
+        print("\n=== Planner Output (raw) ===")
+        planner_raw, planner_json, draft_json = planner_agent(title, content)
+        print(planner_raw.strip())
+
+        print("\n=== Planner Output (parsed+normalized) ===")
+        print(json.dumps(planner_json, indent=2, ensure_ascii=False))
+
+        print("\n=== Reviewer Output (raw) ===")
+        reviewer_raw, reviewer_json, changed, fell_back = reviewer_agent(title, content, planner_json, draft_json)
+        validated = not fell_back
+        print(reviewer_raw.strip())
+
+        print("\n=== Reviewer Output (parsed+normalized) ===")
+        print(json.dumps(reviewer_json, indent=2, ensure_ascii=False))
+        if fell_back:
+            print("\n(no Reviewer attempt validated; using the Planner draft, not cached)")
+
+        final = finalizer(reviewer_json)
+
+    # a Reviewer fallback is a placeholder, not an answer; don't pin it in the cache
+    if conn is not None and not cached and validated:
+        cache_put(conn, key, final)
 
     print("\n=== Final Publish JSON (STRICT) ===")
     print(json.dumps(final, ensure_ascii=False))
@@ -243,7 +770,7 @@ def main():
     print("\n=== Short Answers Helper ===")
     print("Q1 tags:", final["tags"])
     print("Q2 summary:", final["summary"])
-    print("Q3 reviewer changed anything?:", "yes" if changed else "no")
+    print("Q3 reviewer changed anything?:", ("n/a (cached)" if cached else "n/a (combined call)") if changed is None else ("yes" if changed else "no"))
 
     print("\n(run timestamp:", datetime.now().isoformat(timespec="seconds") + ")")
 